@@ -1,6 +1,7 @@
 """
-Batch-process all Slippi .slp files in a directory, dumping each replay to
-two parquet tables (p1 & p2 perspective) with a fixed column schema.
+Process a single Slippi .slp file, or batch-process every .slp file in a
+directory, dumping each replay to two parquet tables (p1 & p2 perspective)
+with a fixed column schema.
 
 Files produced for each replay ( <base> = <stage>_<p1>_vs_<p2>_<timestamp>_<uuid> ):
 
@@ -17,27 +18,43 @@ import time
 import uuid
 import unicodedata
 import pathlib
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from melee import Console, stages
-from melee.enums import Menu
+from melee.enums import Button, Character, Menu
 
 
-MAX_PROJ = 8  # Hard cap on projectile slots
+MAX_PROJ = 8         # Hard cap on projectile slots
+CHUNK_FRAMES = 8192  # Frames per column block (= one parquet row group)
+PARQUET_COMPRESSION = "zstd"
 
-# --- Nana pre-seed constants (schema consistency when ICs aren't present) ---
-NANA_BUTTONS = [
+BOOL, FLOAT = np.dtype(np.bool_), np.dtype(np.float32)
+INT8, INT16, INT32 = np.dtype(np.int8), np.dtype(np.int16), np.dtype(np.int32)
+
+# --- Per-player fields (shared by both ports and their Nana) ---
+PLAYER_BUTTONS = [
     "BUTTON_A", "BUTTON_B", "BUTTON_X", "BUTTON_Y", "BUTTON_Z",
     "BUTTON_L", "BUTTON_R", "BUTTON_START",
     "BUTTON_D_UP", "BUTTON_D_DOWN", "BUTTON_D_LEFT", "BUTTON_D_RIGHT",
 ]
-NANA_BOOL_FLAGS = [
+PLAYER_BOOL_FLAGS = [
     "facing", "invulnerable", "moonwalkwarning", "off_stage", "on_ground",
 ]
-NANA_INTS = [
-    "character", "action", "action_frame", "hitlag_left", "hitstun_left",
-    "invuln_left", "jumps_left", "stock",
-]
-NANA_FLOATS = [
+# Ints use the narrowest width that holds the field's range plus the -1 sentinel
+PLAYER_INTS = {
+    "character":    INT16,  # UNKNOWN_CHARACTER is 255
+    "action":       INT16,
+    "action_frame": INT16,
+    "costume":      INT8,
+    "hitlag_left":  INT16,
+    "hitstun_left": INT16,
+    "invuln_left":  INT16,
+    "jumps_left":   INT8,
+    "stock":        INT8,
+}
+PLAYER_FLOATS = [
     "main_x", "main_y", "c_x", "c_y",
     "l_shldr", "r_shldr",
     "ecb_bottom_x", "ecb_bottom_y",
@@ -48,6 +65,71 @@ NANA_FLOATS = [
     "speed_air_x_self", "speed_ground_x_self",
     "speed_x_attack", "speed_y_attack", "speed_y_self",
 ]
+STAGE_FLOATS = [
+    "blastzone_left", "blastzone_right", "blastzone_top", "blastzone_bottom",
+    "stage_edge_left", "stage_edge_right",
+    "left_platform_height", "left_platform_left", "left_platform_right",
+    "right_platform_height", "right_platform_left", "right_platform_right",
+    "top_platform_height", "top_platform_left", "top_platform_right",
+    "randall_height", "randall_left", "randall_right",
+]
+PROJ_INTS = {
+    "frame":   INT32,
+    "owner":   INT8,
+    "subtype": INT16,
+    "type":    INT32,  # unknown projectile types carry a raw uint16
+}
+PROJ_FLOATS = ["pos_x", "pos_y", "speed_x", "speed_y"]
+
+
+def _state_schema(pref: str) -> dict[str, np.dtype]:
+    schema = {f"{pref}btn_{btn}": BOOL for btn in PLAYER_BUTTONS}
+    schema.update({f"{pref}{flag}": BOOL for flag in PLAYER_BOOL_FLAGS})
+    schema.update({f"{pref}{field}": dtype for field, dtype in PLAYER_INTS.items()})
+    schema.update({f"{pref}{field}": FLOAT for field in PLAYER_FLOATS})
+    return schema
+
+
+def _build_schema() -> dict[str, np.dtype]:
+    schema = {"frame": INT32, "distance": FLOAT, "stage": INT8}
+    schema.update({col: FLOAT for col in STAGE_FLOATS})
+    for pref in ("p1_", "p2_"):
+        schema[f"{pref}port"] = INT8
+        schema.update(_state_schema(pref))
+        schema.update(_state_schema(f"{pref}nana_"))
+    for j in range(MAX_PROJ):
+        schema.update({f"proj{j}_{field}": dtype for field, dtype in PROJ_INTS.items()})
+        schema.update({f"proj{j}_{field}": FLOAT for field in PROJ_FLOATS})
+    return schema
+
+
+# Column name -> dtype. Every replay produces exactly these columns, in order.
+SCHEMA = _build_schema()
+
+# Button enums in PLAYER_BUTTONS order
+BUTTONS = tuple(Button[btn] for btn in PLAYER_BUTTONS)
+
+# Player/Nana fields grouped by dtype. Each group is stored as one 2-D array
+# (field x frame) so extract_state() can write a whole group per frame with a
+# single slice assignment; it must write the fields in exactly this order.
+STATE_PREFIXES = ("p1_", "p2_", "p1_nana_", "p2_nana_")
+STATE_GROUPS = (
+    (BOOL,  [f"btn_{btn}" for btn in PLAYER_BUTTONS] + PLAYER_BOOL_FLAGS),
+    (INT16, [field for field, dtype in PLAYER_INTS.items() if dtype == INT16]),
+    (INT8,  [field for field, dtype in PLAYER_INTS.items() if dtype == INT8]),
+    (FLOAT, PLAYER_FLOATS),
+)
+
+ARROW_SCHEMA = pa.schema(
+    [(col, pa.from_numpy_dtype(dtype)) for col, dtype in SCHEMA.items()]
+)
+
+# Column name -> empty/missing sentinel (False, -1 or NaN by dtype kind)
+_SENTINELS = {"b": False, "i": -1, "f": np.nan}
+DEFAULTS = {col: _SENTINELS[dtype.kind] for col, dtype in SCHEMA.items()}
+
+_SLUG_STRIP = re.compile(r"[^\w\s-]")
+_SLUG_COLLAPSE = re.compile(r"[-\s]+")
 
 log = logging.getLogger(__name__)
 
@@ -58,34 +140,91 @@ def slug(s: str | None) -> str:
     if not s:
         return "unknown"
     s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode()
-    s = re.sub(r"[^\w\s-]", "", s.lower()).strip()
-    return re.sub(r"[-\s]+", "_", s)
+    s = _SLUG_STRIP.sub("", s.lower()).strip()
+    return _SLUG_COLLAPSE.sub("_", s)
 
 
 
 # ----------------------------------------------------------------------------
-def perspective(df: pd.DataFrame, self_pref: str, opp_pref: str) -> pd.DataFrame:
-    rename = {}
-    for col in df.columns:
-        if col.startswith(self_pref):
-            rename[col] = "self_" + col[len(self_pref):]
-        elif col.startswith(opp_pref):
-            rename[col] = "opp_" + col[len(opp_pref):]
-    return df.rename(columns=rename)
+def perspective(schema: pa.Schema, self_pref: str, opp_pref: str) -> pa.Schema:
+    """Rename player-prefixed fields to self_*/opp_* for one point of view."""
+    fields = []
+    for field in schema:
+        if field.name.startswith(self_pref):
+            field = field.with_name("self_" + field.name[len(self_pref):])
+        elif field.name.startswith(opp_pref):
+            field = field.with_name("opp_" + field.name[len(opp_pref):])
+        fields.append(field)
+    return pa.schema(fields)
+
+
+# Output schemas of the -p1 / -p2 files
+P1_SCHEMA = perspective(ARROW_SCHEMA, "p1_", "p2_")
+P2_SCHEMA = perspective(ARROW_SCHEMA, "p2_", "p1_")
+
+
+# ----------------------------------------------------------------------------
+def output_path(out_dir: pathlib.Path, base: str, persp: str) -> pathlib.Path:
+    """Path of one perspective file: <out_dir>/<base>-<persp>.parquet."""
+    return out_dir / f"{base}-{persp}.parquet"
 
 
 # ----------------------------------------------------------------------------
-def preseed_nana(row: dict) -> None:
-    """Fill missing Nana columns with typed defaults for schema consistency."""
-    for pref in ("p1_nana_", "p2_nana_"):
-        for btn in NANA_BUTTONS:
-            row.setdefault(f"{pref}btn_{btn}", False)
-        for flag in NANA_BOOL_FLAGS:
-            row.setdefault(f"{pref}{flag}", False)
-        for field in NANA_INTS:
-            row.setdefault(f"{pref}{field}", -1)
-        for field in NANA_FLOATS:
-            row.setdefault(f"{pref}{field}", float("nan"))
+def new_block(n: int = CHUNK_FRAMES) -> tuple[dict, dict]:
+    """Allocate one block of `n` frames per column, pre-filled with sentinels.
+
+    Bools start False, ints -1 and floats NaN, so empty projectile slots and
+    absent Nana fields need no per-frame writes.
+
+    Returns `(cols, states)`: `cols` maps every SCHEMA column to its 1-D
+    array, and `states` maps each player/Nana prefix to its STATE_GROUPS
+    arrays. The per-field rows of those arrays are the same memory as the
+    matching `cols` entries.
+    """
+    cols = {}
+    states = {}
+    for pref in STATE_PREFIXES:
+        groups = []
+        for dtype, fields in STATE_GROUPS:
+            arr = np.empty((len(fields), n), dtype)
+            for field, row in zip(fields, arr):
+                cols[f"{pref}{field}"] = row
+            groups.append(arr)
+        states[pref] = tuple(groups)
+    for col, dtype in SCHEMA.items():
+        if col not in cols:
+            cols[col] = np.empty(n, dtype)
+        cols[col].fill(DEFAULTS[col])
+    return cols, states
+
+
+# ----------------------------------------------------------------------------
+class ColumnPool:
+    """Cache of new_block() blocks, reused across replays.
+
+    Released blocks are reset to their sentinels and handed out again by the
+    next acquire(), so a batch run allocates its column buffers once per
+    process instead of once per replay. Module state is per process, so each
+    multiprocessing worker keeps its own pool.
+    """
+
+    def __init__(self):
+        self._free: dict[int, list[tuple[dict, dict]]] = {}
+
+    def acquire(self, n: int = CHUNK_FRAMES) -> tuple[dict, dict]:
+        """Return a sentinel-filled block of `n` frames, allocating if none is free."""
+        free = self._free.get(n)
+        return free.pop() if free else new_block(n)
+
+    def release(self, block: tuple[dict, dict]) -> None:
+        """Reset `block` and make it available to the next acquire()."""
+        cols, _ = block
+        for col, arr in cols.items():
+            arr.fill(DEFAULTS[col])
+        self._free.setdefault(len(cols["frame"]), []).append(block)
+
+
+BLOCK_POOL = ColumnPool()
 
 
 # ----------------------------------------------------------------------------
@@ -125,221 +264,222 @@ def extract_stage_static(stage):
 
 
 # ----------------------------------------------------------------------------
-def extract_player(row: dict, pref: str, ps) -> None:
-    """Extract a single player's state into `row` under the given prefix."""
-    row[f"{pref}port"]         = ps.port if hasattr(ps, 'port') else -1
-    row[f"{pref}character"]    = ps.character.value
-    row[f"{pref}action"]       = ps.action.value
-    row[f"{pref}action_frame"] = ps.action_frame
-
-    # buttons
-    for btn, state in ps.controller_state.button.items():
-        row[f"{pref}btn_{btn.name}"] = state
-
-    # sticks & shoulders
-    row[f"{pref}main_x"], row[f"{pref}main_y"] = ps.controller_state.main_stick
-    row[f"{pref}c_x"],    row[f"{pref}c_y"]    = ps.controller_state.c_stick
-    row[f"{pref}l_shldr"] = ps.controller_state.l_shoulder
-    row[f"{pref}r_shldr"] = ps.controller_state.r_shoulder
-
-    row.update({
-        f"{pref}costume":              ps.costume,
-        f"{pref}ecb_bottom_x":         float(ps.ecb_bottom[0]),
-        f"{pref}ecb_bottom_y":         float(ps.ecb_bottom[1]),
-        f"{pref}ecb_left_x":           float(ps.ecb_left[0]),
-        f"{pref}ecb_left_y":           float(ps.ecb_left[1]),
-        f"{pref}ecb_right_x":          float(ps.ecb_right[0]),
-        f"{pref}ecb_right_y":          float(ps.ecb_right[1]),
-        f"{pref}ecb_top_x":            float(ps.ecb_top[0]),
-        f"{pref}ecb_top_y":            float(ps.ecb_top[1]),
-        f"{pref}facing":               ps.facing,
-        f"{pref}hitlag_left":          ps.hitlag_left,
-        f"{pref}hitstun_left":         ps.hitstun_frames_left,
-        f"{pref}invuln_left":          ps.invulnerability_left,
-        f"{pref}invulnerable":         ps.invulnerable,
-        f"{pref}jumps_left":           ps.jumps_left,
-        f"{pref}moonwalkwarning":      ps.moonwalkwarning,
-        f"{pref}off_stage":            ps.off_stage,
-        f"{pref}on_ground":            ps.on_ground,
-        f"{pref}percent":              float(ps.percent),
-        f"{pref}pos_x":                float(ps.position.x),
-        f"{pref}pos_y":                float(ps.position.y),
-        f"{pref}shield_strength":      float(ps.shield_strength),
-        f"{pref}speed_air_x_self":     float(ps.speed_air_x_self),
-        f"{pref}speed_ground_x_self":  float(ps.speed_ground_x_self),
-        f"{pref}speed_x_attack":       float(ps.speed_x_attack),
-        f"{pref}speed_y_attack":       float(ps.speed_y_attack),
-        f"{pref}speed_y_self":         float(ps.speed_y_self),
-        f"{pref}stock":                ps.stock,
-    })
+def extract_state(state: tuple, i: int, ps) -> None:
+    """Write one player (or Nana) state into frame `i` of its STATE_GROUPS arrays."""
+    bools, ints16, ints8, floats = state
+    ctrl = ps.controller_state
+    button = ctrl.button
+
+    bools[:, i] = (
+        *[button[btn] for btn in BUTTONS],
+        ps.facing, ps.invulnerable, ps.moonwalkwarning, ps.off_stage, ps.on_ground,
+    )
+    ints16[:, i] = (
+        ps.character.value, ps.action.value, ps.action_frame,
+        ps.hitlag_left, ps.hitstun_frames_left, ps.invulnerability_left,
+    )
+    ints8[:, i] = (ps.costume, ps.jumps_left, ps.stock)
+    floats[:, i] = (
+        *ctrl.main_stick, *ctrl.c_stick, ctrl.l_shoulder, ctrl.r_shoulder,
+        *ps.ecb_bottom, *ps.ecb_left, *ps.ecb_right, *ps.ecb_top,
+        ps.percent, ps.position.x, ps.position.y, ps.shield_strength,
+        ps.speed_air_x_self, ps.speed_ground_x_self,
+        ps.speed_x_attack, ps.speed_y_attack, ps.speed_y_self,
+    )
+
+
+# ----------------------------------------------------------------------------
+def extract_player(
+    cols: dict, states: dict, i: int, pref: str, port: int, ps,
+    with_nana: bool = True,
+) -> None:
+    """Extract a single player's state (and Nana, if any) into frame `i`.
+
+    Pass `with_nana=False` when no Ice Climbers are in the game to skip the
+    Nana lookup; her columns keep their sentinels either way.
+    """
+    cols[f"{pref}port"][i] = port
+    extract_state(states[pref], i, ps)
 
     # Nana (Ice Climbers partner)
-    nana = ps.nana
-    nana_pref = f"{pref}nana_"
-    if nana:
-        row.update({
-            f"{nana_pref}character":     nana.character.value,
-            f"{nana_pref}action":        nana.action.value,
-            f"{nana_pref}action_frame":  nana.action_frame,
-        })
-        for btn, state in nana.controller_state.button.items():
-            row[f"{nana_pref}btn_{btn.name}"] = state
-        row[f"{nana_pref}main_x"], row[f"{nana_pref}main_y"] = nana.controller_state.main_stick
-        row[f"{nana_pref}c_x"],    row[f"{nana_pref}c_y"]    = nana.controller_state.c_stick
-        row[f"{nana_pref}l_shldr"] = nana.controller_state.l_shoulder
-        row[f"{nana_pref}r_shldr"] = nana.controller_state.r_shoulder
-
-        row.update({
-            f"{nana_pref}costume":            nana.costume,
-            f"{nana_pref}ecb_bottom_x":       float(nana.ecb_bottom[0]),
-            f"{nana_pref}ecb_bottom_y":       float(nana.ecb_bottom[1]),
-            f"{nana_pref}ecb_left_x":         float(nana.ecb_left[0]),
-            f"{nana_pref}ecb_left_y":         float(nana.ecb_left[1]),
-            f"{nana_pref}ecb_right_x":        float(nana.ecb_right[0]),
-            f"{nana_pref}ecb_right_y":        float(nana.ecb_right[1]),
-            f"{nana_pref}ecb_top_x":          float(nana.ecb_top[0]),
-            f"{nana_pref}ecb_top_y":          float(nana.ecb_top[1]),
-            f"{nana_pref}facing":             nana.facing,
-            f"{nana_pref}hitlag_left":        nana.hitlag_left,
-            f"{nana_pref}hitstun_left":       nana.hitstun_frames_left,
-            f"{nana_pref}invuln_left":        nana.invulnerability_left,
-            f"{nana_pref}invulnerable":       nana.invulnerable,
-            f"{nana_pref}jumps_left":         nana.jumps_left,
-            f"{nana_pref}moonwalkwarning":    nana.moonwalkwarning,
-            f"{nana_pref}off_stage":          nana.off_stage,
-            f"{nana_pref}on_ground":          nana.on_ground,
-            f"{nana_pref}percent":            float(nana.percent),
-            f"{nana_pref}pos_x":              float(nana.position.x),
-            f"{nana_pref}pos_y":              float(nana.position.y),
-            f"{nana_pref}shield_strength":    float(nana.shield_strength),
-            f"{nana_pref}speed_air_x_self":   float(nana.speed_air_x_self),
-            f"{nana_pref}speed_ground_x_self": float(nana.speed_ground_x_self),
-            f"{nana_pref}speed_x_attack":     float(nana.speed_x_attack),
-            f"{nana_pref}speed_y_attack":     float(nana.speed_y_attack),
-            f"{nana_pref}speed_y_self":       float(nana.speed_y_self),
-            f"{nana_pref}stock":              nana.stock,
-        })
+    if with_nana and ps.nana:
+        extract_state(states[f"{pref}nana_"], i, ps.nana)
 
 
 # ----------------------------------------------------------------------------
-def extract_projectiles(row: dict, projectiles: list) -> None:
-    """Extract up to MAX_PROJ projectiles into `row`."""
-    for j in range(MAX_PROJ):
+def extract_projectiles(cols: dict, i: int, projectiles: list) -> None:
+    """Extract up to MAX_PROJ projectiles into frame `i`; empty slots keep sentinels."""
+    for j, proj in enumerate(projectiles[:MAX_PROJ]):
         pp = f"proj{j}_"
-        row.update({
-            f"{pp}frame":   -1,
-            f"{pp}owner":   -1,
-            f"{pp}pos_x":   float("nan"),
-            f"{pp}pos_y":   float("nan"),
-            f"{pp}speed_x": float("nan"),
-            f"{pp}speed_y": float("nan"),
-            f"{pp}subtype": -1,
-            f"{pp}type":    -1,
-        })
-        if j < len(projectiles):
-            proj = projectiles[j]
-            row.update({
-                f"{pp}frame":   proj.frame,
-                f"{pp}owner":   proj.owner,
-                f"{pp}pos_x":   float(proj.position.x),
-                f"{pp}pos_y":   float(proj.position.y),
-                f"{pp}speed_x": float(proj.speed.x),
-                f"{pp}speed_y": float(proj.speed.y),
-                f"{pp}subtype": proj.subtype,
-                f"{pp}type":    proj.type.value,
-            })
+        cols[f"{pp}frame"][i]   = proj.frame
+        cols[f"{pp}owner"][i]   = proj.owner
+        cols[f"{pp}pos_x"][i]   = proj.position.x
+        cols[f"{pp}pos_y"][i]   = proj.position.y
+        cols[f"{pp}speed_x"][i] = proj.speed.x
+        cols[f"{pp}speed_y"][i] = proj.speed.y
+        cols[f"{pp}subtype"][i] = proj.subtype
+        cols[f"{pp}type"][i]    = proj.type.value
 
 
 # ----------------------------------------------------------------------------
 def process_replay(slp_path: str, out_dir: pathlib.Path) -> None:
-    """Extract a single .slp replay into two perspective parquet files."""
+    """Extract a single .slp replay into two perspective parquet files.
+
+    Frames are buffered in CHUNK_FRAMES blocks and streamed to both
+    writers a row group at a time, so memory stays bounded regardless of
+    replay length. Row groups are encoded on background threads while the
+    next block is filled. Output goes to hidden .part files that are renamed
+    into place only once the replay has been fully written.
+    """
     console = Console(is_dolphin=False, path=slp_path, allow_old_version=True)
     console.connect()
 
-    rows = []
+    # Two blocks: one is filled while the other is being written out
+    cols, states = BLOCK_POOL.acquire()
+    spare = BLOCK_POOL.acquire()
+    i = 0
+    n_frames = 0
     stage = None
     stage_static = None
     timestamp = None
     p1_char = None
     p2_char = None
 
-    while True:
-        gs = console.step()
-        if gs is None:
-            break
-        if gs.menu_state != Menu.IN_GAME:
-            continue
-
-        # Compute static stage geometry once per game
-        if stage_static is None:
-            stage = gs.stage
-            timestamp = gs.startAt
-            stage_static = extract_stage_static(stage)
-
-        # Randall is the only dynamic stage element
-        if stage and stage.name == "YOSHIS_STORY":
-            r0, r1, r2 = stages.randall_position(gs.frame)
-        else:
-            r0 = r1 = r2 = float("nan")
-
-        row = {
-            "frame": gs.frame,
-            "distance": gs.distance,
-            "stage": stage.value,
-            **stage_static,
-            "randall_height": r0,
-            "randall_left": r1,
-            "randall_right": r2,
-        }
-
-        # Players
-        for idx, (port, ps) in enumerate(gs.players.items()):
-            pref = f"p{idx+1}_"
-            if idx == 0:
-                p1_char = ps.character.name
-            elif idx == 1:
-                p2_char = ps.character.name
-            row[f"{pref}port"] = port
-            extract_player(row, pref, ps)
-
-        # Projectiles
-        extract_projectiles(row, gs.projectiles)
-
-        # Pre-seed Nana columns for schema consistency
-        preseed_nana(row)
-
-        rows.append(row)
-
-    if not rows:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    uniq = uuid.uuid4().hex[:8]
+    part_paths = [
+        output_path(out_dir, f".{uniq}", persp).with_suffix(".parquet.part")
+        for persp in ("p1", "p2")
+    ]
+    writers = []
+    pending = []
+    pool = ThreadPoolExecutor(max_workers=2)  # one thread per perspective file
+
+    def flush(n: int) -> None:
+        """Queue the first `n` buffered frames for both files and swap blocks."""
+        nonlocal cols, states, spare
+        # The spare block is only free once the previous row group is written
+        for fut in pending:
+            fut.result()
+        pending.clear()
+
+        for col, val in stage_static.items():
+            cols[col][:n] = val
+        if not writers:
+            for path, schema in zip(part_paths, (P1_SCHEMA, P2_SCHEMA)):
+                writers.append(pq.ParquetWriter(
+                    path, schema,
+                    compression=PARQUET_COMPRESSION, use_dictionary=True,
+                ))
+        # Convert each column once against the static schema (zero-copy for
+        # numeric columns); both perspectives share the same buffers
+        arrays = [
+            pa.array(cols[field.name][:n], type=field.type, from_pandas=False)
+            for field in ARROW_SCHEMA
+        ]
+        for writer in writers:
+            batch = pa.RecordBatch.from_arrays(arrays, schema=writer.schema)
+            pending.append(pool.submit(writer.write_batch, batch))
+
+        for col, arr in spare[0].items():
+            arr.fill(DEFAULTS[col])
+        (cols, states), spare = spare, (cols, states)
+
+    # Frame-loop lookups bound to locals (LOAD_FAST instead of global/attr)
+    step = console.step
+    in_game = Menu.IN_GAME
+    randall_position = stages.randall_position
+    _extract_player = extract_player
+    _extract_projectiles = extract_projectiles
+    chunk_frames = CHUNK_FRAMES
+    has_randall = False
+    has_nana = False
+
+    try:
+        while True:
+            gs = step()
+            if gs is None:
+                break
+            if gs.menu_state != in_game:
+                continue
+
+            # Compute static stage geometry once per game
+            if stage_static is None:
+                stage = gs.stage
+                timestamp = gs.startAt
+                stage_static = extract_stage_static(stage)
+                has_randall = bool(stage) and stage.name == "YOSHIS_STORY"
+                # Only Popo carries a Nana, and characters are fixed at game start
+                has_nana = any(
+                    ps.character == Character.POPO for ps in gs.players.values()
+                )
+
+            cols["frame"][i]    = gs.frame
+            cols["distance"][i] = gs.distance
+            cols["stage"][i]    = stage.value
+
+            # Randall is the only dynamic stage element
+            if has_randall:
+                r0, r1, r2 = randall_position(gs.frame)
+                cols["randall_height"][i] = r0
+                cols["randall_left"][i]   = r1
+                cols["randall_right"][i]  = r2
+
+            # Players (the schema has exactly two player slots)
+            for idx, (port, ps) in enumerate(gs.players.items()):
+                if idx == 0:
+                    p1_char = ps.character
+                elif idx == 1:
+                    p2_char = ps.character
+                else:
+                    break
+                _extract_player(cols, states, i, f"p{idx+1}_", port, ps, has_nana)
+
+            # Projectiles
+            _extract_projectiles(cols, i, gs.projectiles)
+
+            i += 1
+            n_frames += 1
+            if i == chunk_frames:
+                flush(i)
+                i = 0
+
+        if i:
+            flush(i)
+        for fut in pending:
+            fut.result()
+    except BaseException:
+        # Don't leave half-written files behind
+        wait(pending)
+        for writer in writers:
+            writer.close()
+        for path in part_paths:
+            path.unlink(missing_ok=True)
+        raise
+    finally:
+        pool.shutdown()
+        BLOCK_POOL.release((cols, states))
+        BLOCK_POOL.release(spare)
+    for writer in writers:
+        writer.close()
+
+    if not n_frames:
         log.warning("No in-game frames found in %s, skipping", slp_path)
         return
 
-    df_combined = pd.DataFrame(rows)
-
-    # Cast float64 -> float32
-    float64_cols = df_combined.select_dtypes(include=["float64"]).columns
-    for col in float64_cols:
-        df_combined[col] = df_combined[col].astype("float32")
-
-    # Perspectives
-    df_p1 = perspective(df_combined, "p1_", "p2_")
-    df_p2 = perspective(df_combined, "p2_", "p1_")
-
     # Filenames
     stage_slug = slug(stage.name)
-    p1_slug    = slug(p1_char)
-    p2_slug    = slug(p2_char)
+    p1_slug    = slug(p1_char and p1_char.name)
+    p2_slug    = slug(p2_char and p2_char.name)
     ts_slug    = slug(timestamp)
-    uniq       = uuid.uuid4().hex[:8]
     base       = f"{stage_slug}_{p1_slug}_vs_{p2_slug}_{ts_slug}_{uniq}"
 
-    out_dir.mkdir(parents=True, exist_ok=True)
-    df_p1.to_parquet(out_dir / f"{base}-p1.parquet", index=False)
-    df_p2.to_parquet(out_dir / f"{base}-p2.parquet", index=False)
+    for path, persp in zip(part_paths, ("p1", "p2")):
+        path.replace(output_path(out_dir, base, persp))
 
     log.info(
         "Wrote %d frames x %d cols -> %s{-p1,-p2}.parquet",
-        len(df_combined), df_combined.shape[1], base,
+        n_frames, len(SCHEMA), base,
     )
 
 
@@ -360,15 +500,31 @@ def _worker_fn(args):
         process_replay(slp_path, out_dir)
         return (slp_path, True)
     except Exception:
+        log.warning("Failed to extract %s", slp_path, exc_info=True)
         return (slp_path, False)
 
 
+# ----------------------------------------------------------------------------
+def find_replays(input_path: str) -> list[str]:
+    """Return `input_path` itself if it is a file, else the .slp files inside it."""
+    if os.path.isfile(input_path):
+        return [input_path]
+    # DirEntry caches the file type from the listing, so no extra stat per file
+    with os.scandir(input_path) as it:
+        return sorted(
+            e.path for e in it if e.name.lower().endswith(".slp") and e.is_file()
+        )
+
+
 # ----------------------------------------------------------------------------
 def main():
     parser = argparse.ArgumentParser(
         description="Extract Slippi .slp replays to per-frame parquet files."
     )
-    parser.add_argument("slp_dir", help="Directory containing .slp replay files")
+    parser.add_argument(
+        "input",
+        help="A single .slp replay, or a directory containing .slp replay files",
+    )
     parser.add_argument(
         "-o", "--out-dir",
         default="./extracted",
@@ -393,26 +549,26 @@ def main():
         datefmt="%H:%M:%S",
     )
 
-    slp_dir = args.slp_dir
+    input_path = args.input
     out_dir = pathlib.Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     n_workers = args.workers or mp.cpu_count()
 
-    files = sorted(f for f in os.listdir(slp_dir) if f.lower().endswith(".slp"))
+    files = find_replays(input_path)
 
     if args.skip_existing:
         done_log = out_dir / ".done_slps.txt"
         if done_log.exists():
             already_done = set(done_log.read_text().splitlines())
             before = len(files)
-            files = [f for f in files if f not in already_done]
+            files = [f for f in files if os.path.basename(f) not in already_done]
             log.info("Skipping %d already-extracted replays", before - len(files))
 
     total = len(files)
-    log.info("Found %d .slp files in %s", total, slp_dir)
+    log.info("Found %d .slp files in %s", total, input_path)
     log.info("Using %d parallel workers", n_workers)
 
-    tasks = [(os.path.join(slp_dir, f), out_dir) for f in files]
+    tasks = [(f, out_dir) for f in files]
 
     succeeded = 0
     failed = 0